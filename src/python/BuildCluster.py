@@ -7,18 +7,31 @@ Input to this program are:
     * Edges are not weighted
   * The number of partitions to create
   * An output file containing clustering result
+  * Optionally, hierarchical partitioning options (any of them enables the hierarchical mode):
+    * branching=B: recursively splits the graph into B parts (default is 2, i.e. recursive bisection)
+    * size=S: stops splitting parts having at most S nodes, even if the number of partitions is not reached
+    * jobs=J: number of processes splitting parts in parallel (default is the number of CPUs)
+    * tree=F: an output file recording the split tree
 
 Output is a cluster description, in a proprietary text format:
   * Each line is either a comment (starting with //)
   * Or the description of a edge, in the form:
     * (P.N):(P':N') where (P:N) is the source node (P=partition number, N=node identifier) and
       (P':N') is the target node
+
+The split tree file is a proprietary text format too:
+  * Each line is either a comment (starting with //)
+  * Or the description of a part, in the form:
+    * I:P:N:K where I is the part identifier, P the identifier of its parent (-1 for the root), N its
+      number of nodes and K the resulting partition number (-1 if the part was split)
 """
 
+from multiprocessing import Pool
 from sys import argv
 from time import time
-from typing import List, Union, TextIO
+from typing import Dict, List, Union, TextIO, Tuple
 
+import numpy as np
 from numpy.core.records import ndarray
 from scipy.io import mmread
 from scipy.sparse import coo_matrix
@@ -32,11 +45,15 @@ class ProgramConfiguration:
     each argument type.
     """
 
+    OPTIONS = ("branching", "size", "jobs", "tree")
+
     def __init__(self, args: List[str]):
-        if len(args) != 4:
-            print("Usage: %s <mtx file> <number of partitions> <output file>" % args[0])
+        if len(args) < 4 or self.__parse_options(args[4:]) is None:
+            print("Usage: %s <mtx file> <number of partitions> <output file> [branching=B] [size=S] [jobs=J] [tree=F]"
+                  % args[0])
             exit(1)
         self.args = args
+        self.options = self.__parse_options(args[4:])
 
     def input_file(self) -> str:
         return self.args[1]
@@ -47,6 +64,35 @@ class ProgramConfiguration:
     def nr_partitions(self) -> int:
         return int(self.args[2])
 
+    def is_hierarchical(self) -> bool:
+        return len(self.options) > 0
+
+    def branching(self) -> int:
+        return int(self.options.get("branching", 2))
+
+    def max_part_size(self) -> Union[int, None]:
+        return int(self.options["size"]) if "size" in self.options else None
+
+    def nr_jobs(self) -> Union[int, None]:
+        return int(self.options["jobs"]) if "jobs" in self.options else None
+
+    def tree_file(self) -> Union[str, None]:
+        return self.options.get("tree")
+
+    @classmethod
+    def __parse_options(cls, args: List[str]) -> Union[Dict[str, str], None]:
+        result = {}
+        for each_arg in args:
+            items = each_arg.split("=", 1)
+            if len(items) != 2 or items[0] not in cls.OPTIONS or items[0] in result:
+                return None
+            if items[0] != "tree" and not (items[1].isdigit() and int(items[1]) > 0):
+                return None
+            result[items[0]] = items[1]
+        if "branching" in result and int(result["branching"]) < 2:
+            return None
+        return result
+
 
 class Cluster:
     """Invokes spectral clustering on a graph to create a given number of partitions
@@ -61,6 +107,131 @@ class Cluster:
         return self.sc.labels_
 
 
+class Part:
+    """A node of the split tree: a set of nodes of the initial graph, to be split into a number of partitions
+    """
+
+    def __init__(self, identifier: int, parent: int, nodes: ndarray, nr_partitions: int):
+        self.identifier = identifier
+        self.parent = parent
+        # Indexes (from 0) of the nodes in the initial graph
+        self.nodes = nodes
+        self.nr_partitions = nr_partitions
+        # The resulting partition number, when this part is a leaf of the split tree
+        self.partition = -1
+
+    def nr_children(self, branching: int, max_part_size: Union[int, None]) -> int:
+        """
+        :return: the number of parts to split this one into, 0 or 1 if it must not be split
+        """
+        if max_part_size is not None and len(self.nodes) <= max_part_size:
+            return 0
+        # Spectral clustering requires less clusters than nodes
+        return min(branching, self.nr_partitions, len(self.nodes) - 1)
+
+    def splits_per_node(self, max_part_size: Union[int, None]) -> bool:
+        """
+        :return: True if this part is not larger than its number of partitions, so that each node is a partition
+        """
+        if max_part_size is not None and len(self.nodes) <= max_part_size:
+            return False
+        return 1 < len(self.nodes) <= self.nr_partitions
+
+
+class PartSplitter:
+    """Splits the sub-graph induced by a part with spectral clustering. Runs in a worker process.
+    """
+
+    @staticmethod
+    def split(task: Tuple[coo_matrix, int]) -> List[int]:
+        (sub_graph, nr_parts) = task
+        return Cluster(sub_graph, nr_parts).create()
+
+
+class HierarchicalCluster:
+    """Recursively splits a graph into a given number of partitions
+
+    Each level of recursion only works on the sub-graphs induced by the parts of the previous level, which are
+    split in parallel. The number of partitions assigned to a part is distributed among its children, in
+    proportion to their sizes.
+    """
+
+    def __init__(self, graph: Union[ndarray, coo_matrix], nr_partitions: int, branching: int,
+                 max_part_size: Union[int, None], nr_jobs: Union[int, None]):
+        self.graph = graph.tocsr()
+        self.nr_partitions = nr_partitions
+        self.branching = branching
+        self.max_part_size = max_part_size
+        self.nr_jobs = nr_jobs
+        self.parts: List[Part] = []
+        # Stopping on the part size may create less partitions than requested: the actual number, once created
+        self.nr_created_partitions = 0
+
+    def create(self) -> List[int]:
+        level = [self.__new_part(-1, np.arange(self.graph.shape[0]), self.nr_partitions)]
+        leaves = []
+        with Pool(self.nr_jobs) as pool:
+            while len(level) > 0:
+                to_split = []
+                next_level = []
+                for each_part in level:
+                    if each_part.splits_per_node(self.max_part_size):
+                        next_level += self.__create_children(each_part, np.arange(len(each_part.nodes)))
+                    elif each_part.nr_children(self.branching, self.max_part_size) > 1:
+                        to_split.append(each_part)
+                    else:
+                        leaves.append(each_part)
+                if len(to_split) > 0:
+                    print("splitting %d parts" % len(to_split))
+                    tasks = [(self.graph[p.nodes][:, p.nodes],
+                              p.nr_children(self.branching, self.max_part_size)) for p in to_split]
+                    for (each_part, each_labels) in zip(to_split, pool.map(PartSplitter.split, tasks)):
+                        labels = np.asarray(each_labels)
+                        # A split must create at least two children, each strictly smaller than the part: otherwise
+                        # the only child would be split again forever
+                        if len(np.unique(labels)) < 2:
+                            leaves.append(each_part)
+                        else:
+                            next_level += self.__create_children(each_part, labels)
+                level = next_level
+        # Number partitions in the order of the split tree, so that siblings get consecutive numbers
+        result = np.zeros(self.graph.shape[0], dtype=int)
+        for (partition, each_leaf) in enumerate(sorted(leaves, key=self.__tree_order)):
+            each_leaf.partition = partition
+            result[each_leaf.nodes] = partition
+        self.nr_created_partitions = len(leaves)
+        return result
+
+    def write_tree_into(self, out: TextIO):
+        for each_part in self.parts:
+            out.write("%d:%d:%d:%d\n" % (each_part.identifier, each_part.parent, len(each_part.nodes),
+                                         each_part.partition))
+
+    def __new_part(self, parent: int, nodes: ndarray, nr_partitions: int) -> Part:
+        part = Part(len(self.parts), parent, nodes, nr_partitions)
+        self.parts.append(part)
+        return part
+
+    def __create_children(self, part: Part, labels: ndarray) -> List[Part]:
+        children_nodes = [part.nodes[labels == each_label] for each_label in np.unique(labels)]
+        # Every child gets at least one partition, the remaining ones are distributed by largest remainder
+        sizes = np.array([len(each_nodes) for each_nodes in children_nodes])
+        shares = (part.nr_partitions - len(sizes)) * sizes / float(np.sum(sizes))
+        budgets = 1 + np.floor(shares).astype(int)
+        remainder = part.nr_partitions - int(np.sum(budgets))
+        for each_child in np.argsort(np.floor(shares) - shares)[:remainder]:
+            budgets[each_child] += 1
+        return [self.__new_part(part.identifier, each_nodes, int(each_budget))
+                for (each_nodes, each_budget) in zip(children_nodes, budgets)]
+
+    def __tree_order(self, part: Part) -> List[int]:
+        path = []
+        while part.parent >= 0:
+            path.insert(0, part.identifier)
+            part = self.parts[part.parent]
+        return path
+
+
 class ClusterPrinter:
     """
     Unwraps a cluster to produce sub-graphs.
@@ -88,13 +259,17 @@ class ClusterPrinter:
 # ================================================================================
 class Main:
     def __init__(self, program_configuration: ProgramConfiguration):
+        self.configuration = program_configuration
         self.input_file = program_configuration.input_file()
         self.nr_partitions = program_configuration.nr_partitions()
         self.output_file = program_configuration.output_file()
 
     def execute(self):
         g = self.__load_file(self.input_file)
-        c = self.__partition(g, self.nr_partitions)
+        if self.configuration.is_hierarchical():
+            (c, self.nr_partitions) = self.__partition_hierarchically(g)
+        else:
+            c = self.__partition(g, self.nr_partitions)
         self.__write_result(self.output_file, g, c, self.input_file, self.nr_partitions)
 
     @classmethod
@@ -113,6 +288,23 @@ class Main:
         print("partitioning complete in %d seconds" % (time() - start_time))
         return cluster
 
+    def __partition_hierarchically(self, graph: Union[ndarray, coo_matrix]) -> Tuple[List[int], int]:
+        print("partitioning hierarchically")
+        start_time = time()
+        hc = HierarchicalCluster(graph, self.nr_partitions, self.configuration.branching(),
+                                 self.configuration.max_part_size(), self.configuration.nr_jobs())
+        cluster = hc.create()
+        print("partitioning complete in %d seconds" % (time() - start_time))
+        tree_file = self.configuration.tree_file()
+        if tree_file is not None:
+            with open(tree_file, "wt") as f:
+                f.write("// source: %s\n" % self.input_file)
+                f.write("// nr partitions: %s\n" % hc.nr_created_partitions)
+                f.write("// part:parent:nr nodes:partition\n")
+                hc.write_tree_into(f)
+                print("split tree written into %s" % tree_file)
+        return cluster, hc.nr_created_partitions
+
     @classmethod
     def __write_result(cls, output_file: str, graph: Union[ndarray, coo_matrix], cluster: List[int], input_file: str,
                        nr_partitions: int):
@@ -126,5 +318,7 @@ class Main:
 
 
 # ================================================================================
-configuration = ProgramConfiguration(argv)
-Main(configuration).execute()
+# Worker processes of the hierarchical mode may re-import this module: only run from the main one
+if __name__ == "__main__":
+    configuration = ProgramConfiguration(argv)
+    Main(configuration).execute()
@@ -107,7 +107,8 @@ class MetaGraph:
         self.edge_counter = 0
 
     def set_nr_partitions(self, nr_partitions: int):
-        self.v_node_counter = nr_partitions
+        # Partitions are nodes 1 to nr_partitions, virtual nodes come next
+        self.v_node_counter = nr_partitions + 1
 
     def record(self, x: Node, y: Node):
         # Graph is non-oriented. No need to record edges in the two directions. The arbitrary rule then
@@ -116,7 +117,7 @@ class MetaGraph:
         px = int(x.partition) + 1
         py = int(y.partition) + 1
         if px < py:
-            self.file.write("%% %s:%s" % (x, y))
+            self.file.write("%% %s:%s\n" % (x, y))
             self.file.write("%d %d\n" % (px, self.v_node_counter))
             self.file.write("%d %d\n" % (self.v_node_counter, py))
             self.v_node_counter += 1
@@ -124,7 +125,7 @@ class MetaGraph:
 
     def close(self):
         self.file.close()
-        self.__write_header(self.file_name, self.v_node_counter, self.edge_counter)
+        self.__write_header(self.file_name, self.v_node_counter - 1, self.edge_counter)
 
     @classmethod
     def __write_header(cls, file_name: str, nr_nodes: int, nr_edges: int) -> Union[TextIO, None]:
@@ -4,17 +4,27 @@ Reads a collection of partitions, created by BuildFragments, to produce their tr
 Input to this program are:
   * The base name of fragment files
   * The number of fragments to process
+  * Optionally, a distance mode (default computes exact distances between every pair of borders):
+    * hops=N: stops each BFS after N hops and only emits the pairs of borders within this limit
+    * landmarks=L: runs exact BFS from L landmark borders only and emits the border-to-landmark
+      distances. Shortest paths in the resulting traversal graph are the triangle-inequality upper
+      bounds of the real distances; the error of these estimates is reported for each fragment
+      (on a sample of pairs of borders for the largest fragments).
 
 Output is a collection of mtx files, with the same base name, suffixed by the fragment number
 and a capital T.
 """
 
 from sys import argv
-from typing import List, TextIO, Set
+from typing import List, TextIO, Set, Tuple, Union
 
 import numpy as np
-from scipy.sparse import coo_matrix
-from sklearn.utils.graph import single_source_shortest_path_length
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# Number of pairs of borders used to estimate the error of landmark distances
+ERROR_SAMPLE_SIZE = 10000
+RANDOM_SEED = 0
 
 
 class ProgramConfiguration:
@@ -25,8 +35,8 @@ class ProgramConfiguration:
     """
 
     def __init__(self, args: List[str]):
-        if len(args) != 3:
-            print("Usage: %s <fragments base name> <number of fragments>" % args[0])
+        if len(args) not in (3, 4) or (len(args) == 4 and self.__parse_mode(args[3]) is None):
+            print("Usage: %s <fragments base name> <number of fragments> [hops=N | landmarks=L]" % args[0])
             exit(1)
         self.args = args
 
@@ -36,6 +46,26 @@ class ProgramConfiguration:
     def nr_fragments(self) -> int:
         return int(self.args[2])
 
+    def max_hops(self) -> Union[int, None]:
+        return self.__mode_value("hops")
+
+    def nr_landmarks(self) -> Union[int, None]:
+        return self.__mode_value("landmarks")
+
+    def __mode_value(self, mode: str) -> Union[int, None]:
+        if len(self.args) == 4:
+            (name, value) = self.__parse_mode(self.args[3])
+            if name == mode:
+                return value
+        return None
+
+    @classmethod
+    def __parse_mode(cls, arg: str) -> Union[Tuple[str, int], None]:
+        items = arg.split("=")
+        if len(items) == 2 and items[0] in ("hops", "landmarks") and items[1].isdigit() and int(items[1]) > 0:
+            return items[0], int(items[1])
+        return None
+
 
 class Node:
     def __init__(self, partition: int, index: int):
@@ -56,27 +86,56 @@ class Edge:
 
 
 class CooMatrixBuilder:
-    def __init__(self, nodes: Set[int]):
+    """
+    Creates the adjacency matrix of the edges connecting the given nodes to each other. Each edge is
+    recorded in both directions, since graph traversal follows the rows of the matrix.
+    """
+
+    def __init__(self, nodes: Set[int], edges: List[Edge]):
         self.nodes = nodes
+        self.edges = edges
 
     def execute(self) -> coo_matrix:
-        i = []
-        j = []
-        v = []
-        nodes = sorted(self.nodes)
-        for each_node in nodes:
-            for each_other_node in nodes:
-                if each_other_node > each_node:
-                    i.append(each_node - 1)
-                    j.append(each_other_node - 1)
-                    v.append(1)
-        npi = np.array(i)
-        npj = np.array(j)
-        npv = np.array(v)
-        nr_nodes = nodes[-1]
+        """
+        :return: the adjacency matrix, indexed by the rank of nodes (in ascending order of identifiers)
+        """
+        local = {node: index for (index, node) in enumerate(sorted(self.nodes))}
+        pairs = set()
+        for each_edge in self.edges:
+            x = each_edge.x.index
+            y = each_edge.y.index
+            if x != y and x in self.nodes and y in self.nodes:
+                pairs.add((local[x], local[y]))
+                pairs.add((local[y], local[x]))
+        pairs = sorted(pairs)
+        npi = np.array([p[0] for p in pairs], dtype=int)
+        npj = np.array([p[1] for p in pairs], dtype=int)
+        npv = np.ones(len(pairs), dtype=int)
+        nr_nodes = len(self.nodes)
         return coo_matrix((npv, (npi, npj)), shape=(nr_nodes, nr_nodes))
 
 
+class FragmentGraph:
+    """
+    The graph of a partition, indexed locally so that a BFS costs the size of the partition, not of the whole graph.
+    """
+
+    def __init__(self, nodes: Set[int], edges: List[Edge]):
+        self.nodes = np.array(sorted(nodes), dtype=np.int64)
+        self.graph: csr_matrix = CooMatrixBuilder(nodes, edges).execute().tocsr()
+
+    def local_indexes(self, nodes: List[int]) -> np.ndarray:
+        return np.searchsorted(self.nodes, nodes)
+
+    def distances_from(self, local: int, max_hops: Union[int, None] = None) -> np.ndarray:
+        """
+        :return: the distance from the given node to every node of the partition, by local index: inf if
+                 unreachable or beyond max_hops
+        """
+        limit = np.inf if max_hops is None else max_hops
+        return dijkstra(self.graph, directed=True, unweighted=True, indices=local, limit=limit)
+
+
 class PartitionDescriptor:
     def __init__(self, partition_id: int):
         self.pid = partition_id
@@ -116,8 +175,8 @@ class PartitionDescriptor:
         print("\tBorders     = %d = %s" % (len(self.borders), self.borders))
         print("\tQ%%        = %d" % (100.0 * self.q()))
 
-    def get_initial_graph(self) -> coo_matrix:
-        return CooMatrixBuilder(self.all_nodes).execute()
+    def get_initial_graph(self) -> FragmentGraph:
+        return FragmentGraph(self.all_nodes, self.edges)
 
 
 class FragmentProcessor:
@@ -155,24 +214,113 @@ class WeightedEdge:
 
 
 class TraversalGraphBuilder:
-    def __init__(self, partition: PartitionDescriptor):
+    """
+    Computes the distances between every pair of borders of a partition.
+
+    When max_hops is set, each BFS stops after this number of hops and only the pairs of borders
+    within this limit are emitted.
+    """
+
+    def __init__(self, partition: PartitionDescriptor, max_hops: Union[int, None] = None):
+        self.partition = partition
+        self.max_hops = max_hops
+        self.max_node = 0
+        self.edges: List[WeightedEdge] = []
+
+    def create_graph(self):
+        initial_graph = self.partition.get_initial_graph()
+        borders = np.array(sorted(self.partition.borders), dtype=np.int64)
+        border_locals = initial_graph.local_indexes(borders)
+        for (k, each_node) in enumerate(borders):
+            distances = initial_graph.distances_from(border_locals[k], self.max_hops)[border_locals[k + 1:]]
+            # Unreachable borders (or beyond max_hops) are at an infinite distance
+            for each_other in np.flatnonzero(np.isfinite(distances)):
+                edge = WeightedEdge(int(each_node), int(borders[k + 1 + each_other]), int(distances[each_other]))
+                self.edges.append(edge)
+        if len(borders) > 0:
+            self.max_node = int(borders[-1])
+        return self
+
+
+class LandmarkTraversalGraphBuilder:
+    """
+    Approximates the distances between borders of a partition from a few landmark borders.
+
+    Runs an exact BFS from each landmark only and emits the edges from every border to every landmark.
+    The shortest path between two borders in the resulting graph is min(d(x, l) + d(l, y)) over the
+    landmarks l: an upper bound of the real distance. The lower bound max(|d(x, l) - d(l, y)|) gives
+    the error of this estimate, reported by summarize().
+    """
+
+    def __init__(self, partition: PartitionDescriptor, nr_landmarks: int):
         self.partition = partition
+        self.nr_landmarks = nr_landmarks
         self.max_node = 0
         self.edges: List[WeightedEdge] = []
+        self.landmarks: List[int] = []
+        # One row per landmark, one column per border (sorted): distances, inf when unreachable
+        self.borders = sorted(partition.borders)
+        self.distances = np.zeros((0, len(self.borders)))
 
     def create_graph(self):
         initial_graph = self.partition.get_initial_graph()
-        for each_node in self.partition.borders:
-            shortest_paths = single_source_shortest_path_length(initial_graph, each_node - 1)
-            for each_other_node in self.partition.borders:
-                if each_other_node > each_node:
-                    shortest_distance = shortest_paths[each_other_node - 1]
-                    edge = WeightedEdge(each_node, each_other_node, shortest_distance)
-                    self.edges.append(edge)
-            if each_node > self.max_node:
-                self.max_node = each_node
+        if len(self.borders) == 0:
+            return self
+        border_locals = initial_graph.local_indexes(self.borders)
+        self.max_node = self.borders[-1]
+        # Farthest-first selection: the next landmark is the border that is the farthest from the landmarks
+        # already chosen, which spreads the landmarks over the partition (and over its connected components).
+        closest_landmark = np.full(len(self.borders), np.inf)
+        next_landmark = 0
+        while len(self.landmarks) < min(self.nr_landmarks, len(self.borders)):
+            landmark = self.borders[next_landmark]
+            self.landmarks.append(landmark)
+            row = initial_graph.distances_from(border_locals[next_landmark])[border_locals]
+            self.distances = np.vstack([self.distances, row])
+            closest_landmark = np.minimum(closest_landmark, row)
+            next_landmark = int(np.argmax(closest_landmark))
+            if closest_landmark[next_landmark] == 0:
+                # Every border is a landmark already
+                break
+        for (k, (each_landmark, each_row)) in enumerate(zip(self.landmarks, self.distances)):
+            for (each_border, each_distance) in zip(self.borders, each_row):
+                # Edges between landmarks are emitted once, from the row of the first landmark
+                if each_border not in self.landmarks[:k + 1] and np.isfinite(each_distance):
+                    self.edges.append(WeightedEdge(each_landmark, each_border, int(each_distance)))
         return self
 
+    def summarize(self):
+        if len(self.landmarks) == 0:
+            return
+        (x, y) = self.__sample_pairs()
+        dx = self.distances[:, x]
+        dy = self.distances[:, y]
+        upper = np.min(dx + dy, axis=0)
+        with np.errstate(invalid="ignore"):
+            # Differences involving an unreachable border bring no information
+            lower = np.max(np.where(np.isfinite(dx - dy), np.abs(dx - dy), 0), axis=0)
+        reachable = np.isfinite(upper)
+        error = (upper[reachable] - lower[reachable]) / np.maximum(lower[reachable], 1)
+        print("\tLandmarks   = %d = %s" % (len(self.landmarks), self.landmarks))
+        if len(error) > 0:
+            print("\tEstimates   = %d pairs%s, %d exact, error <= %d%% (mean) / %d%% (max)" %
+                  (len(error), " (sampled)" if len(x) < len(self.borders) * (len(self.borders) - 1) // 2 else "",
+                   int(np.count_nonzero(error == 0)), 100.0 * np.mean(error), 100.0 * np.max(error)))
+
+    def __sample_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the indexes of every pair of borders or, when there are too many of them, of a random sample of
+                 ERROR_SAMPLE_SIZE pairs: the report then costs O(L) per pair instead of O(B.B.L) overall.
+        """
+        nr_borders = len(self.borders)
+        if nr_borders * (nr_borders - 1) // 2 <= ERROR_SAMPLE_SIZE:
+            return np.triu_indices(nr_borders, 1)
+        rng = np.random.default_rng(RANDOM_SEED)
+        x = rng.integers(0, nr_borders, ERROR_SAMPLE_SIZE)
+        # Shift y by 1 to nr_borders - 1 so that it is never equal to x
+        y = (x + rng.integers(1, nr_borders, ERROR_SAMPLE_SIZE)) % nr_borders
+        return x, y
+
 
 class Main:
     def __init__(self, configuration: ProgramConfiguration):
@@ -183,10 +331,18 @@ class Main:
             with open("%s_%d.txt" % (self.configuration.input_basename(), each_fragment_id), "rt") as f:
                 descriptor = FragmentProcessor(f, each_fragment_id).get_descriptor()
                 descriptor.summarize()
-                tg = TraversalGraphBuilder(descriptor).create_graph()
+                tg = self.__create_traversal_graph(descriptor)
                 self.__write_graph_into("%s_%dT.mtx" % (self.configuration.input_basename(), each_fragment_id),
                                         tg.max_node, tg.edges)
 
+    def __create_traversal_graph(self, descriptor: PartitionDescriptor) -> Union[TraversalGraphBuilder,
+                                                                                LandmarkTraversalGraphBuilder]:
+        if self.configuration.nr_landmarks() is not None:
+            tg = LandmarkTraversalGraphBuilder(descriptor, self.configuration.nr_landmarks()).create_graph()
+            tg.summarize()
+            return tg
+        return TraversalGraphBuilder(descriptor, self.configuration.max_hops()).create_graph()
+
     @classmethod
     def __write_graph_into(self, file_name: str, nr_nodes: int, weighted_edges: List[WeightedEdge]):
         with open(file_name, "wt") as f:
@@ -0,0 +1,438 @@
+"""
+Answers node-to-node shortest path queries from the fragments of a graph.
+
+Input to this program are:
+  * The base name of fragment files, produced by BuildFragments, along with the traversal graphs produced by
+    CreateTraversalGraphs
+  * The number of fragments
+  * The queries, either:
+    * A file with one query per line: the identifiers of two nodes, separated by a space
+    * random=N: N random queries
+  * Optionally, the initial mtx file: compares the query latency against a plain BFS on the initial graph
+
+Output is one line per query (except for random queries), in the form "x y d", where d is the distance
+between nodes x and y (-1 if y cannot be reached from x).
+
+A query combines:
+  * A BFS in the fragment of the source, to its borders
+  * A search over the "overlay" graph, made of the traversal graphs edges (border to border distances inside
+    a fragment) and of the edges crossing fragments
+  * A BFS in the fragment of the target, from its borders
+The meta-graph tells which fragments are connected, so that unreachable targets are rejected immediately.
+
+Distances are exact when the traversal graphs are exact. They are upper bounds of the real distances when
+traversal graphs are hop-bounded or approximated with landmarks.
+"""
+
+import random
+from collections import OrderedDict
+from sys import argv
+from time import time
+from typing import Dict, List, Set, TextIO, Tuple, Union
+
+import numpy as np
+from scipy.io import mmread
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import dijkstra, shortest_path
+
+DEFAULT_CACHE_SIZE = 1024
+# Maximum number of distances held by the cached fragment tables (4 bytes each)
+TABLE_CACHE_ENTRIES = 1 << 25
+RANDOM_SEED = 0
+
+
+class ProgramConfiguration:
+    """User arguments
+
+    Verifies that the program is supplied enough arguments and provides one function for
+    each argument type.
+    """
+
+    def __init__(self, args: List[str]):
+        if len(args) not in (4, 5):
+            print("Usage: %s <fragments base name> <number of fragments> <query file | random=N> [mtx file]"
+                  % args[0])
+            exit(1)
+        self.args = args
+
+    def input_basename(self) -> str:
+        return self.args[1]
+
+    def nr_fragments(self) -> int:
+        return int(self.args[2])
+
+    def query_file(self) -> Union[str, None]:
+        return None if self.args[3].startswith("random=") else self.args[3]
+
+    def nr_random_queries(self) -> int:
+        return int(self.args[3].replace("random=", ""))
+
+    def graph_file(self) -> Union[str, None]:
+        return self.args[4] if len(self.args) == 5 else None
+
+
+class Node:
+    def __init__(self, partition: int, index: int):
+        self.partition = partition
+        self.index = index
+
+    def __str__(self) -> str:
+        return "%d.%d" % (self.partition, self.index)
+
+
+class Edge:
+    def __init__(self, node1: Node, node2: Node):
+        self.x = node1
+        self.y = node2
+
+    def __str__(self) -> str:
+        return "(%s):(%s)" % (self.x, self.y)
+
+
+class WeightedMtxReader:
+    """
+    Reads the edges of the mtx files produced by this project, with an optional weight (1 by default).
+    Comments may appear anywhere in the file.
+    """
+
+    def __init__(self, mtx_file: TextIO):
+        self.file = mtx_file
+
+    def edges(self) -> List[Tuple[int, int, int]]:
+        result = []
+        size_read = False
+        for each_line in self.file:
+            items = each_line.split()
+            if len(items) == 0 or items[0].startswith("%"):
+                continue
+            if not size_read:
+                size_read = True
+            elif len(items) == 2:
+                result.append((int(items[0]), int(items[1]), 1))
+            else:
+                result.append((int(items[0]), int(items[1]), int(items[2])))
+        return result
+
+
+class Fragment:
+    """
+    The sub-graph of one partition, indexed locally to keep BFS proportional to the fragment size.
+    """
+
+    def __init__(self, pid: int, nodes: Set[int], edges: Set[Tuple[int, int]], borders: Set[int]):
+        self.pid = pid
+        self.nodes = np.array(sorted(nodes), dtype=np.int64)
+        self.borders = np.array(sorted(borders), dtype=np.int64)
+        local = {node: index for (index, node) in enumerate(self.nodes)}
+        i = [local[edge[0]] for edge in edges]
+        j = [local[edge[1]] for edge in edges]
+        self.graph = coo_matrix((np.ones(len(i), dtype=int), (i, j)), shape=(len(self.nodes), len(self.nodes)))
+        self.graph = self.graph.tocsr()
+        # Local indexes of the borders
+        self.border_locals = np.searchsorted(self.nodes, self.borders)
+
+    def local_index(self, node: int) -> int:
+        return int(np.searchsorted(self.nodes, node))
+
+    def distances_from(self, node: int) -> np.ndarray:
+        """
+        :return: the distance from the given node to every node of this fragment, by local index (inf if unreachable)
+        """
+        return shortest_path(self.graph, directed=True, unweighted=True, indices=self.local_index(node))
+
+    def border_distances(self, distances: np.ndarray) -> np.ndarray:
+        """
+        :return: the given distances to the borders of this fragment, in the order of borders
+        """
+        return distances[self.border_locals]
+
+
+class FragmentIndex:
+    """
+    Loads the fragments, traversal graphs and meta-graph of a partitioned graph into a compact index.
+    """
+
+    def __init__(self, basename: str, nr_fragments: int):
+        self.fragments: List[Fragment] = []
+        cross_edges: Set[Tuple[int, int]] = set()
+        partition_of: Dict[int, int] = {}
+        for each_fragment_id in range(0, nr_fragments):
+            with open("%s_%d.txt" % (basename, each_fragment_id), "rt") as f:
+                self.fragments.append(self.__load_fragment(f, each_fragment_id, cross_edges, partition_of))
+        # Partition of each node, -1 if the node does not belong to any fragment
+        self.max_node = max(partition_of.keys(), default=0)
+        self.partition_of = np.full(self.max_node + 1, -1, dtype=np.int32)
+        for (node, partition) in partition_of.items():
+            self.partition_of[node] = partition
+        # Overlay graph: borders are indexed from 0, in ascending order
+        self.borders = np.array(sorted(set().union(*[set(f.borders) for f in self.fragments])), dtype=np.int64)
+        self.overlay = self.__load_overlay(basename, cross_edges)
+        # Overlay indexes of the borders of each fragment
+        self.fragment_borders = [np.searchsorted(self.borders, f.borders) for f in self.fragments]
+        with open("%s_meta.mtx" % basename, "rt") as f:
+            self.component_of = self.__load_components(f, nr_fragments)
+
+    def partition(self, node: int) -> int:
+        return int(self.partition_of[node]) if 0 < node <= self.max_node else -1
+
+    def are_connected(self, partition1: int, partition2: int) -> bool:
+        return self.component_of[partition1] == self.component_of[partition2]
+
+    def summarize(self):
+        print("fragments: %d, nodes: %d, borders: %d, overlay edges: %d" %
+              (len(self.fragments), int(np.count_nonzero(self.partition_of >= 0)), len(self.borders),
+               self.overlay.nnz))
+
+    @classmethod
+    def __load_fragment(cls, fragment_file: TextIO, pid: int, cross_edges: Set[Tuple[int, int]],
+                        partition_of: Dict[int, int]) -> Fragment:
+        nodes = set()
+        edges = set()
+        borders = set()
+        for each_line in fragment_file:
+            items = each_line.replace("(", "").replace(")", "").split(":")
+            if len(items) == 2:
+                (node1, node2) = map(lambda s: s.split("."), items)
+                edge = Edge(Node(int(node1[0]), int(node1[1])), Node(int(node2[0]), int(node2[1])))
+                nodes.add(edge.x.index)
+                partition_of[edge.x.index] = edge.x.partition
+                if edge.y.partition == pid:
+                    if edge.x.index != edge.y.index:
+                        edges.add((edge.x.index, edge.y.index))
+                        edges.add((edge.y.index, edge.x.index))
+                else:
+                    borders.add(edge.x.index)
+                    cross_edges.add((edge.x.index, edge.y.index))
+                    cross_edges.add((edge.y.index, edge.x.index))
+        return Fragment(pid, nodes, edges, borders)
+
+    def __load_overlay(self, basename: str, cross_edges: Set[Tuple[int, int]]) -> csr_matrix:
+        edges = [(x, y, 1) for (x, y) in cross_edges]
+        for each_fragment in self.fragments:
+            with open("%s_%dT.mtx" % (basename, each_fragment.pid), "rt") as f:
+                for (x, y, w) in WeightedMtxReader(f).edges():
+                    edges.append((x, y, w))
+                    edges.append((y, x, w))
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+        i = np.searchsorted(self.borders, edges[:, 0])
+        j = np.searchsorted(self.borders, edges[:, 1])
+        # The same pair of borders may be connected by several edges: keep the shortest one
+        order = np.lexsort((edges[:, 2], j, i))
+        (i, j, v) = (i[order], j[order], edges[order, 2])
+        first = np.ones(len(i), dtype=bool)
+        first[1:] = (i[1:] != i[:-1]) | (j[1:] != j[:-1])
+        return coo_matrix((v[first], (i[first], j[first])), shape=(len(self.borders), len(self.borders))).tocsr()
+
+    @classmethod
+    def __load_components(cls, meta_file: TextIO, nr_fragments: int) -> List[int]:
+        """
+        :return: the connected component of every partition in the meta-graph (nodes 1 to nr_fragments are the
+                 partitions, next ones are virtual nodes).
+        """
+        neighbors: Dict[int, List[int]] = {}
+        for (x, y, _) in WeightedMtxReader(meta_file).edges():
+            neighbors.setdefault(x, []).append(y)
+            neighbors.setdefault(y, []).append(x)
+        result = [-1] * nr_fragments
+        for each_partition in range(0, nr_fragments):
+            if result[each_partition] >= 0:
+                continue
+            to_visit = [each_partition + 1]
+            visited = {each_partition + 1}
+            while len(to_visit) > 0:
+                node = to_visit.pop()
+                if node <= nr_fragments:
+                    result[node - 1] = each_partition
+                for each_neighbor in neighbors.get(node, []):
+                    if each_neighbor not in visited:
+                        visited.add(each_neighbor)
+                        to_visit.append(each_neighbor)
+        return result
+
+
+class LruCache:
+    """
+    Keeps the most recently used entries, up to a given capacity.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class NodeDistances:
+    """
+    Distances from a node to the nodes of its fragment, and to its borders only (in the order of borders).
+    """
+
+    def __init__(self, in_fragment: np.ndarray, borders: np.ndarray):
+        self.in_fragment = in_fragment
+        self.borders = borders
+
+
+class DistanceOracle:
+    """
+    Computes shortest path distances from the fragment index, caching the distances from recent sources and targets.
+
+    Cached entries are sized by fragments: the distances from a node to the nodes of its fragment, and the overlay
+    distances from the borders of a fragment to every border. The latter are shared by all the nodes of a fragment,
+    and cached up to TABLE_CACHE_ENTRIES distances.
+    """
+
+    def __init__(self, index: FragmentIndex, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.index = index
+        self.sources = LruCache(cache_size)
+        largest_table = len(index.borders) * max([len(b) for b in index.fragment_borders], default=0)
+        self.fragment_tables = LruCache(max(TABLE_CACHE_ENTRIES // max(largest_table, 1), 1))
+
+    def query(self, x: int, y: int) -> int:
+        """
+        :return: the distance from x to y, -1 if y cannot be reached
+        """
+        if x == y:
+            return 0
+        px = self.index.partition(x)
+        py = self.index.partition(y)
+        if px < 0 or py < 0 or not self.index.are_connected(px, py):
+            return -1
+        source = self.__node_distances(x, px)
+        best = source.in_fragment[self.index.fragments[py].local_index(y)] if px == py else np.inf
+        target = self.__node_distances(y, py)
+        if len(source.borders) > 0 and len(target.borders) > 0:
+            # Leave the source fragment through a border, follow the overlay graph to a border of the target fragment
+            table = self.__fragment_table(px)[:, self.index.fragment_borders[py]]
+            best = min(best, np.min(source.borders[:, np.newaxis] + table + target.borders[np.newaxis, :]))
+        return int(best) if np.isfinite(best) else -1
+
+    def query_batch(self, queries: List[Tuple[int, int]]) -> List[int]:
+        """
+        Answers a list of queries, grouping them by source fragment then by source, so that each source and
+        fragment table is computed once.
+
+        :return: the distances, in the order of the queries
+        """
+        result = [0] * len(queries)
+        for each_query in sorted(range(len(queries)),
+                                 key=lambda q: (self.index.partition(queries[q][0]), queries[q][0])):
+            result[each_query] = self.query(*queries[each_query])
+        return result
+
+    def __node_distances(self, x: int, px: int) -> NodeDistances:
+        result = self.sources.get(x)
+        if result is None:
+            fragment = self.index.fragments[px]
+            in_fragment = fragment.distances_from(x).astype(np.float32)
+            result = NodeDistances(in_fragment, fragment.border_distances(in_fragment))
+            self.sources.put(x, result)
+        return result
+
+    def __fragment_table(self, px: int) -> np.ndarray:
+        """
+        :return: the overlay distances from each border of the fragment (rows) to every border (columns)
+        """
+        result = self.fragment_tables.get(px)
+        if result is None:
+            result = dijkstra(self.index.overlay, directed=True, indices=self.index.fragment_borders[px])
+            result = result.astype(np.float32)
+            self.fragment_tables.put(px, result)
+        return result
+
+
+class PlainBfs:
+    """
+    Reference: a BFS on the initial graph, stopping as soon as the target is reached.
+    """
+
+    def __init__(self, graph: Union[np.ndarray, coo_matrix]):
+        self.graph = csr_matrix(graph)
+
+    def query(self, x: int, y: int) -> int:
+        if x == y:
+            return 0
+        if x > self.graph.shape[0] or y > self.graph.shape[0]:
+            return -1
+        visited = {x - 1}
+        level = [x - 1]
+        distance = 0
+        while len(level) > 0:
+            distance += 1
+            next_level = []
+            for each_node in level:
+                for each_neighbor in self.graph.indices[self.graph.indptr[each_node]:self.graph.indptr[each_node + 1]]:
+                    if each_neighbor == y - 1:
+                        return distance
+                    if each_neighbor not in visited:
+                        visited.add(each_neighbor)
+                        next_level.append(each_neighbor)
+            level = next_level
+        return -1
+
+
+class Main:
+    def __init__(self, configuration: ProgramConfiguration):
+        self.configuration = configuration
+
+    def execute(self):
+        print("loading fragments %s" % self.configuration.input_basename())
+        start_time = time()
+        index = FragmentIndex(self.configuration.input_basename(), self.configuration.nr_fragments())
+        print("fragments loaded in %d seconds" % (time() - start_time))
+        index.summarize()
+        queries = self.__load_queries(index)
+        oracle = DistanceOracle(index)
+        start_time = time()
+        distances = oracle.query_batch(queries)
+        oracle_time = time() - start_time
+        print("%d queries answered in %.3f seconds (%d cache hits)" % (len(queries), oracle_time, oracle.sources.hits))
+        if self.configuration.query_file() is not None:
+            for ((x, y), d) in zip(queries, distances):
+                print("%d %d %d" % (x, y, d))
+        if self.configuration.graph_file() is not None:
+            self.__benchmark(queries, distances, oracle_time)
+
+    def __load_queries(self, index: FragmentIndex) -> List[Tuple[int, int]]:
+        result = []
+        if self.configuration.query_file() is not None:
+            with open(self.configuration.query_file(), "rt") as f:
+                for each_line in f:
+                    items = each_line.split()
+                    if len(items) == 2:
+                        result.append((int(items[0]), int(items[1])))
+        else:
+            random.seed(RANDOM_SEED)
+            for _ in range(0, self.configuration.nr_random_queries()):
+                result.append((random.randint(1, index.max_node), random.randint(1, index.max_node)))
+        return result
+
+    def __benchmark(self, queries: List[Tuple[int, int]], distances: List[int], oracle_time: float):
+        graph = mmread(self.configuration.graph_file())
+        bfs = PlainBfs(graph)
+        start_time = time()
+        expected = [bfs.query(x, y) for (x, y) in queries]
+        bfs_time = time() - start_time
+        nr_mismatches = sum(1 for (d, e) in zip(distances, expected) if d != e)
+        nr_queries = max(len(queries), 1)
+        print("plain BFS: %d queries answered in %.3f seconds" % (len(queries), bfs_time))
+        print("latency per query: oracle = %.1f us, plain BFS = %.1f us" %
+              (1e6 * oracle_time / nr_queries, 1e6 * bfs_time / nr_queries))
+        print("mismatches: %d" % nr_mismatches)
+
+
+# ================================================================================
+Main(ProgramConfiguration(argv)).execute()